@@ -15,55 +15,133 @@ Notes:
 - Gaps ('-') tolerated; removed for length/GLS calculations.
 """
 
-from Bio import SeqIO
+from Bio.SeqIO.FastaIO import SimpleFastaParser
+import numpy as np
 import pandas as pd
-import re, argparse, sys, json, os, time, logging
+import io, re, argparse, sys, json, os, time, logging
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Tuple, List, Optional
 
+try:
+    from numba import njit, prange
+except ImportError:  # optional: JIT kernels are skipped without numba
+    njit = None
+try:
+    import hyperscan
+except ImportError:  # optional: regex path is used without hyperscan
+    hyperscan = None
+
 LOG = logging.getLogger("na-ha")
 
 # ---------- FASTA & metadata ----------
 
-def fasta_to_dataframe(fasta_file: str) -> pd.DataFrame:
-    headers, sequences, lengths = [], [], []
-    for record in SeqIO.parse(fasta_file, "fasta"):
-        hdr = record.id if record.id else str(record.description).split()[0]
-        seq = str(record.seq)
-        headers.append(hdr)
+def _parse_fasta_handle(handle) -> Tuple[List[str], List[str]]:
+    headers, sequences = [], []
+    # SimpleFastaParser yields plain (title, seq) strings: no SeqRecord/Seq objects.
+    for title, seq in SimpleFastaParser(handle):
+        headers.append(title.split()[0] if title.strip() else "")
         sequences.append(seq)
-        lengths.append(len(seq))
-    return pd.DataFrame({"Header": headers, "Sequence": sequences, "Length": lengths})
-
-_EPI_RE = re.compile(r'EPI_ISL_\d+', re.IGNORECASE)
-_DATE_RE = re.compile(r'\d{4}-\d{2}-\d{2}')
+    return headers, sequences
+
+def _parse_fasta_range(fasta_file: str, start: int, end: int) -> Tuple[List[str], List[str]]:
+    with open(fasta_file, "rb") as fh:
+        fh.seek(start)
+        buf = fh.read(end - start)
+    return _parse_fasta_handle(io.TextIOWrapper(io.BytesIO(buf)))
+
+def fasta_chunk_bounds(fasta_file: str, n_chunks: int) -> List[Tuple[int,int]]:
+    """Split a FASTA into ~equal byte ranges, each starting at a '>' record line."""
+    size = os.path.getsize(fasta_file)
+    starts = [0]
+    with open(fasta_file, "rb") as fh:
+        for i in range(1, n_chunks):
+            pos = max(size * i // n_chunks, starts[-1])
+            fh.seek(pos)
+            carry = b""
+            while True:
+                block = fh.read(1 << 20)
+                if not block:
+                    pos = size
+                    break
+                hit = (carry + block).find(b"\n>")
+                if hit >= 0:
+                    pos = pos - len(carry) + hit + 1
+                    break
+                pos += len(block)
+                carry = block[-1:]
+            if pos > starts[-1]:
+                starts.append(pos)
+    return [(a, b) for a, b in zip(starts, starts[1:] + [size]) if a < b]
+
+def fasta_to_dataframe(fasta_file: str, workers: int = 1) -> pd.DataFrame:
+    if workers > 1:
+        bounds = fasta_chunk_bounds(fasta_file, workers)
+        headers, sequences = [], []
+        if bounds:  # empty file: no ranges, nothing to parse
+            with ProcessPoolExecutor(max_workers=len(bounds)) as ex:
+                futs = [ex.submit(_parse_fasta_range, fasta_file, a, b) for a, b in bounds]
+                for fut in futs:
+                    h, q = fut.result()
+                    headers += h; sequences += q
+    else:
+        with io.open(fasta_file, "rt", buffering=1 << 20) as handle:
+            headers, sequences = _parse_fasta_handle(handle)
+    # Arrow-backed strings: compact storage and C-level .str ops downstream.
+    seq_ser = pd.Series(sequences, dtype="string[pyarrow]")
+    lengths = seq_ser.str.len().to_numpy()
+    # Explicit dtype so an empty FASTA still yields a .str-capable Header column.
+    hdr_ser = pd.Series(headers, dtype=object)
+    return pd.DataFrame({"Header": hdr_ser, "Sequence": seq_ser, "Length": lengths})
+
+_EPI_PAT = r'EPI_ISL_\d+'
+_DATE_PAT = r'\d{4}-\d{2}-\d{2}'
+_EPI_RE = re.compile(_EPI_PAT, re.IGNORECASE)
+_DATE_RE = re.compile(_DATE_PAT)
 
 def extract_epi_and_date(header: str) -> Tuple[Optional[str], Optional[str]]:
-    epi = (_EPI_RE.search(header).group(0)) if _EPI_RE.search(header) else None
-    dt  = (_DATE_RE.search(header).group(0)) if _DATE_RE.search(header) else None
+    m_epi = _EPI_RE.search(header)
+    m_dt = _DATE_RE.search(header)
+    epi = m_epi.group(0) if m_epi else None
+    dt = m_dt.group(0) if m_dt else None
     return epi, dt
 
 def annotate_epi_and_date(df: pd.DataFrame, label: str = "") -> pd.DataFrame:
-    epis, dates = [], []
-    for h in df["Header"]:
-        epi, dt = extract_epi_and_date(h)
-        if epi is None:
-            LOG.warning("[%s] Missing EPI in header; dropped: %s", label, h)
-        epis.append(epi); dates.append(dt)
-    out = df.copy()
-    out["EPI"] = epis; out["Date"] = dates
+    hdrs = df["Header"]
+    epis = hdrs.str.extract(f"({_EPI_PAT})", flags=re.IGNORECASE, expand=False)
+    dates = hdrs.str.extract(f"({_DATE_PAT})", expand=False)
+    for h in hdrs[epis.isna()]:
+        LOG.warning("[%s] Missing EPI in header; dropped: %s", label, h)
+    out = df.assign(EPI=epis, Date=dates)
     out = out.dropna(subset=["EPI"])
     return out
 
 def filter_by_date(df: pd.DataFrame, min_date: Optional[str], max_date: Optional[str]) -> pd.DataFrame:
     if "Date" not in df.columns:
         return df
-    out = df.copy()
+    mask = pd.Series(True, index=df.index)
     if min_date:
-        out = out[(out["Date"].isna()) | (out["Date"] >= min_date)]
+        mask &= df["Date"].isna() | (df["Date"] >= min_date)
     if max_date:
-        out = out[(out["Date"].isna()) | (out["Date"] <= max_date)]
-    return out
+        mask &= df["Date"].isna() | (df["Date"] <= max_date)
+    return df.loc[mask]
+
+def in_date_range(dt: Optional[str], min_date: Optional[str], max_date: Optional[str]) -> bool:
+    """Scalar twin of filter_by_date: undated records are always kept."""
+    if dt is None:
+        return True
+    return (not min_date or dt >= min_date) and (not max_date or dt <= max_date)
+
+def iter_records(fasta_file: str, label: str = ""):
+    """Yield (EPI, Date, Sequence) per FASTA record, skipping headers without an EPI."""
+    with io.open(fasta_file, "rt", buffering=1 << 20) as handle:
+        for title, seq in SimpleFastaParser(handle):
+            hdr = title.split()[0] if title.strip() else ""
+            epi, dt = extract_epi_and_date(hdr)
+            if epi is None:
+                LOG.warning("[%s] Missing EPI in header; dropped: %s", label, hdr)
+                continue
+            yield epi, dt, seq
 
 # ---------- NA stalk ----------
 
@@ -79,26 +157,131 @@ def find_stalk_bounds(reference_seq: str, begin_regex: str, end_regex: str,
         raise ValueError("Computed stalk start >= end. Check regex/offsets.")
     return start_idx, end_idx
 
+_GAP = ord("-")
+
+def sequences_to_byte_matrix(sequences: pd.Series) -> Optional[np.ndarray]:
+    """Pack aligned sequences into an (n, L) uint8 array; None if lengths differ."""
+    lengths = sequences.str.len()
+    if lengths.nunique() != 1:
+        return None
+    buf = "".join(sequences).encode("ascii", errors="replace")
+    return np.frombuffer(buf, dtype=np.uint8).reshape(len(sequences), int(lengths.iloc[0]))
+
+_L2_BYTES = 256 * 1024
+
+def count_non_gaps(arr: np.ndarray, start: int, end: int) -> np.ndarray:
+    """Non-gap residues per row in arr[:, start:end], in L2-sized row blocks."""
+    n = arr.shape[0]
+    width = max(min(end, arr.shape[1]) - start, 1)
+    block = max(_L2_BYTES // width, 1)
+    cnt = np.empty(n, dtype=np.int32)
+    for i0 in range(0, n, block):
+        cnt[i0:i0 + block] = (arr[i0:i0 + block, start:end] != _GAP).sum(axis=1, dtype=np.int32)
+    return cnt
+
 def extract_stalk_lengths(df: pd.DataFrame, stalk_start: int, stalk_end: int) -> pd.DataFrame:
-    out = df.copy()
-    out["Stalk_length"] = [
-        seq[stalk_start:stalk_end].replace("-", "").__len__() for seq in out["Sequence"]
-    ]
-    return out
+    arr = sequences_to_byte_matrix(df["Sequence"])
+    if arr is not None:
+        lengths = count_non_gaps(arr, stalk_start, stalk_end)
+    else:
+        # Ragged alignment: fall back to per-record slicing.
+        lengths = [
+            seq[stalk_start:stalk_end].replace("-", "").__len__() for seq in df["Sequence"]
+        ]
+    return df.assign(Stalk_length=lengths)
 
 # ---------- HA GLS ----------
 
 _GLS_RE = re.compile(r'[Nn][^Pp][SsTt]')
 
-def count_gls_motifs(sequences: List[str]) -> List[int]:
-    counts = []
-    for seq in sequences:
-        seq = seq.replace("-", "")
-        counts.append(len(_GLS_RE.findall(seq)))
-    return counts
+_GLS_HS_DB = None
+
+def _gls_hs_db():
+    global _GLS_HS_DB
+    if _GLS_HS_DB is None:
+        db = hyperscan.Database(mode=hyperscan.HS_MODE_BLOCK)
+        # \x00 separates records in the scan buffer, so it may not fill the X slot.
+        db.compile(expressions=[rb"[Nn][^Pp\x00][SsTt]"], ids=[0],
+                   flags=[hyperscan.HS_FLAG_SOM_LEFTMOST])
+        _GLS_HS_DB = db
+    return _GLS_HS_DB
+
+def count_gls_hs(sequences: pd.Series) -> np.ndarray:
+    """Hyperscan GLS counts over one NUL-joined buffer of ungapped sequences."""
+    stripped = sequences.str.replace("-", "", regex=False)
+    buf = "\x00".join(stripped).encode("ascii", errors="replace")
+    row_starts = np.zeros(len(stripped), dtype=np.int64)
+    row_starts[1:] = np.cumsum(stripped.str.len().to_numpy()[:-1] + 1)
+    hits, last_end = [], [0]
+
+    def on_match(_id, frm, to, _flags, _ctx):
+        # Hyperscan reports overlapping matches; keep findall's non-overlapping ones.
+        if frm >= last_end[0]:
+            hits.append(frm); last_end[0] = to
+
+    _gls_hs_db().scan(buf, match_event_handler=on_match)
+    rows = np.searchsorted(row_starts, np.asarray(hits, dtype=np.int64), side="right") - 1
+    return np.bincount(rows, minlength=len(stripped))
+
+def count_gls_motifs(sequences: pd.Series) -> pd.Series:
+    if not isinstance(sequences, pd.Series):
+        sequences = pd.Series(list(sequences), dtype=object)
+    if hyperscan is not None and len(sequences):
+        return pd.Series(count_gls_hs(sequences), index=sequences.index)
+    return sequences.str.replace("-", "", regex=False).str.count(_GLS_RE.pattern)
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def count_gls_nb(arr):
+        """Per-row N-X-[ST] (X != P) counts over a packed byte matrix, gaps skipped.
+
+        Matches are non-overlapping, as with _GLS_RE.findall on the ungapped sequence.
+        """
+        n, L = arr.shape
+        counts = np.zeros(n, dtype=np.int32)
+        for i in prange(n):
+            c0 = 0; c1 = 0; k = 0
+            for j in range(L):
+                c2 = arr[i, j]
+                if c2 == 45:  # '-'
+                    continue
+                if (k >= 2 and (c0 == 78 or c0 == 110) and c1 != 80 and c1 != 112
+                        and (c2 == 83 or c2 == 115 or c2 == 84 or c2 == 116)):
+                    counts[i] += 1
+                    k = 0
+                    continue
+                c0 = c1; c1 = c2; k += 1
+        return counts
+
+# ---------- Contingency ----------
+
+def contingency_counts(merged: pd.DataFrame) -> pd.DataFrame:
+    """Frequency of each (Stalk_length, GLS_count) pair, sorted by both keys."""
+    a, ua = pd.factorize(merged["Stalk_length"], sort=True)
+    b, ub = pd.factorize(merged["GLS_count"], sort=True)
+    keep = (a >= 0) & (b >= 0)  # factorize codes NaN as -1
+    flat = a[keep] * len(ub) + b[keep]
+    counts = np.bincount(flat, minlength=len(ua) * len(ub)).reshape(len(ua), len(ub))
+    ia, ib = np.nonzero(counts)
+    return pd.DataFrame({
+        "Stalk_length": ua[ia],
+        "GLS_count": ub[ib],
+        "Frequency": counts[ia, ib],
+    })
 
 # ---------- Utilities ----------
 
+def read_table(path: str, fmt: str = "csv") -> pd.DataFrame:
+    if fmt == "parquet":
+        return pd.read_parquet(path, engine="pyarrow", dtype_backend="pyarrow")
+    return pd.read_csv(path, engine="pyarrow", dtype_backend="pyarrow")
+
+def write_table(df: pd.DataFrame, path: str, fmt: str = "csv"):
+    if fmt == "parquet":
+        df.to_parquet(path, engine="pyarrow", compression="zstd", index=False)
+    else:
+        df.to_csv(path, index=False)
+
 def write_audit_log(path: str, args: argparse.Namespace):
     meta = {
         "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
@@ -116,8 +299,8 @@ def setup_logging(level: str):
 
 # ---------- Subcommands ----------
 
-def run_na(a: argparse.Namespace):
-    df = annotate_epi_and_date(fasta_to_dataframe(a.fasta), "NA")
+def _na_from_frame(a: argparse.Namespace) -> pd.DataFrame:
+    df = annotate_epi_and_date(fasta_to_dataframe(a.fasta, a.workers), "NA")
     before = len(df)
     df = filter_by_date(df, a.min_date, a.max_date)
     LOG.info("[NA] rows: %d → %d after date filters", before, len(df))
@@ -126,50 +309,96 @@ def run_na(a: argparse.Namespace):
     ref_seq = df["Sequence"].iloc[0]
     s_idx, e_idx = find_stalk_bounds(ref_seq, a.begin_regex, a.end_regex, a.start_offset, a.end_offset)
     if a.drop_first:
-        df = df.iloc[1:].copy()
-    df = extract_stalk_lengths(df, s_idx, e_idx)
-    df[["EPI","Date","Stalk_length"]].to_csv(a.out, index=False)
+        df = df.iloc[1:]
+    # Keep only the output columns; the Sequence-bearing frame dies with this scope,
+    # before run_na starts writing.
+    return extract_stalk_lengths(df, s_idx, e_idx)[["EPI","Date","Stalk_length"]]
+
+def _na_streamed(a: argparse.Namespace) -> pd.DataFrame:
+    # Sequences are dropped as soon as their stalk length is known.
+    epis, dates, stalks = [], [], []
+    before, bounds = 0, None
+    for epi, dt, seq in iter_records(a.fasta, "NA"):
+        before += 1
+        if not in_date_range(dt, a.min_date, a.max_date):
+            continue
+        if bounds is None:  # first kept record is the reference
+            bounds = find_stalk_bounds(seq, a.begin_regex, a.end_regex, a.start_offset, a.end_offset)
+            if a.drop_first:
+                continue
+        s_idx, e_idx = bounds
+        epis.append(epi); dates.append(dt)
+        # Window width from the indices (same clamping as slicing, no copy).
+        width = len(range(*slice(s_idx, e_idx).indices(len(seq))))
+        stalks.append(width - seq.count("-", s_idx, e_idx))
+    kept = len(epis) + (1 if bounds is not None and a.drop_first else 0)
+    LOG.info("[NA] rows: %d → %d after date filters", before, kept)
+    if bounds is None: sys.exit("[NA] No valid NA sequences.")
+    return pd.DataFrame({"EPI": epis, "Date": dates, "Stalk_length": stalks})
+
+def run_na(a: argparse.Namespace):
+    df = _na_streamed(a) if a.stream else _na_from_frame(a)
+    write_table(df, a.out, a.format)
     LOG.info("[NA] wrote %s (%d rows)", a.out, len(df))
     if a.audit: write_audit_log(a.audit, a)
 
-def run_ha(a: argparse.Namespace):
-    df = annotate_epi_and_date(fasta_to_dataframe(a.fasta), "HA")
+def _ha_from_frame(a: argparse.Namespace) -> pd.DataFrame:
+    df = annotate_epi_and_date(fasta_to_dataframe(a.fasta, a.workers), "HA")
     before = len(df)
     df = filter_by_date(df, a.min_date, a.max_date)
     LOG.info("[HA] rows: %d → %d after date filters", before, len(df))
     if df.empty: sys.exit("[HA] No valid HA sequences.")
-    df = df.copy()
-    df["GLS_count"] = count_gls_motifs(df["Sequence"].tolist())
-    df[["EPI","Date","GLS_count"]].to_csv(a.out, index=False)
+    arr = sequences_to_byte_matrix(df["Sequence"]) if njit is not None else None
+    gls = count_gls_nb(arr) if arr is not None else count_gls_motifs(df["Sequence"])
+    # Attach the metric to the narrow frame so Sequence (and arr) are freed on return.
+    return df[["EPI","Date"]].assign(GLS_count=gls)
+
+def _ha_streamed(a: argparse.Namespace) -> pd.DataFrame:
+    # Sequences are dropped as soon as their GLS count is known.
+    epis, dates, gls = [], [], []
+    before = 0
+    for epi, dt, seq in iter_records(a.fasta, "HA"):
+        before += 1
+        if not in_date_range(dt, a.min_date, a.max_date):
+            continue
+        epis.append(epi); dates.append(dt)
+        gls.append(len(_GLS_RE.findall(seq.replace("-", ""))))
+    LOG.info("[HA] rows: %d → %d after date filters", before, len(epis))
+    if not epis: sys.exit("[HA] No valid HA sequences.")
+    return pd.DataFrame({"EPI": epis, "Date": dates, "GLS_count": gls})
+
+def run_ha(a: argparse.Namespace):
+    df = _ha_streamed(a) if a.stream else _ha_from_frame(a)
+    write_table(df, a.out, a.format)
     LOG.info("[HA] wrote %s (%d rows)", a.out, len(df))
     if a.audit: write_audit_log(a.audit, a)
 
 def run_merge(a: argparse.Namespace):
-    ha = pd.read_csv(a.ha); na = pd.read_csv(a.na)
+    ha = read_table(a.ha, a.format); na = read_table(a.na, a.format)
     miss = []
     for cols, dfname in [({"EPI","GLS_count"}, ha), ({"EPI","Stalk_length"}, na)]:
         need = cols - set(dfname.columns)
         if need: miss.append(str(need))
     if miss: sys.exit(f"[MERGE] Missing columns: {', '.join(miss)}")
-    merged = ha.merge(na[["EPI","Stalk_length"]], on="EPI", how="inner")
+    merged = (ha.set_index("EPI")
+              .join(na.set_index("EPI")[["Stalk_length"]], how="inner")
+              .reset_index())
     merged.to_csv(a.out, index=False)
     LOG.info("[MERGE] wrote %s (%d rows)", a.out, len(merged))
     if a.counts:
-        counts = (merged.groupby(["Stalk_length","GLS_count"])
-                  .size().reset_index(name="Frequency")
-                  .sort_values(["Stalk_length","GLS_count"]))
+        counts = contingency_counts(merged)
         counts.to_csv(a.counts, index=False)
         LOG.info("[MERGE] wrote counts %s", a.counts)
     if a.audit: write_audit_log(a.audit, a)
 
 def run_plot(a: argparse.Namespace):
+    os.environ.setdefault("MPLBACKEND", "Agg")
     import matplotlib.pyplot as plt
     if a.counts_csv:
-        df = pd.read_csv(a.counts_csv)
+        df = read_table(a.counts_csv)
     else:
-        merged = pd.read_csv(a.merged_csv)
-        df = (merged.groupby(["Stalk_length","GLS_count"])
-              .size().reset_index(name="Frequency"))
+        merged = read_table(a.merged_csv)
+        df = contingency_counts(merged)
     if df.empty: sys.exit("[PLOT] No data to plot.")
     x = df["GLS_count"]; y = df["Stalk_length"]; s = df["Frequency"] * a.scale
     plt.figure()
@@ -197,14 +426,28 @@ def build_parser() -> argparse.ArgumentParser:
     pa.add_argument("--end-offset", type=int, default=0)
     pa.add_argument("--drop-first", action="store_true")
     pa.add_argument("--min-date"); pa.add_argument("--max-date")
+    ga = pa.add_mutually_exclusive_group()
+    ga.add_argument("--workers", type=int, default=1,
+                    help="Processes for parallel FASTA parsing (default: 1)")
+    ga.add_argument("--stream", action="store_true",
+                    help="Process records one at a time without holding sequences in memory")
     pa.add_argument("--out", required=True)
+    pa.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                    help="Output format (parquet for intermediates fed to merge)")
     pa.add_argument("--audit", help="Write JSON audit log to this path")
     pa.set_defaults(func=run_na)
 
     ph = sub.add_parser("ha", help="Count HA glycosylation motifs")
     ph.add_argument("--fasta", required=True)
     ph.add_argument("--min-date"); ph.add_argument("--max-date")
+    gh = ph.add_mutually_exclusive_group()
+    gh.add_argument("--workers", type=int, default=1,
+                    help="Processes for parallel FASTA parsing (default: 1)")
+    gh.add_argument("--stream", action="store_true",
+                    help="Process records one at a time without holding sequences in memory")
     ph.add_argument("--out", required=True)
+    ph.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                    help="Output format (parquet for intermediates fed to merge)")
     ph.add_argument("--audit")
     ph.set_defaults(func=run_ha)
 
@@ -212,6 +455,8 @@ def build_parser() -> argparse.ArgumentParser:
     pm.add_argument("--ha", required=True)
     pm.add_argument("--na", required=True)
     pm.add_argument("--out", required=True)
+    pm.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                    help="Format of the --ha/--na inputs; merged/counts outputs stay CSV")
     pm.add_argument("--counts")
     pm.add_argument("--audit")
     pm.set_defaults(func=run_merge)
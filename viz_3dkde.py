@@ -18,11 +18,11 @@ Example:
 """
 
 import argparse
+import os
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+from scipy.signal import fftconvolve
 from scipy.stats import gaussian_kde
-from mpl_toolkits.mplot3d.art3d import Poly3DCollection
 
 def parse_args():
     p = argparse.ArgumentParser(description="3D KDE ridges over groups")
@@ -33,7 +33,7 @@ def parse_args():
     p.add_argument("--xmax", type=float, default=None)
     p.add_argument("--grid", type=int, default=300, help="Grid points for KDE (default: 300)")
     p.add_argument("--bw", type=float, default=None,
-                   help="Bandwidth factor for gaussian_kde (e.g., 0.4). If None, use Scott's rule.")
+                   help="Bandwidth factor (kernel sd = bw * data sd, e.g., 0.4). If None, use Scott's rule.")
     p.add_argument("--alpha", type=float, default=0.6, help="Fill alpha (default: 0.6)")
     p.add_argument("--gap", type=float, default=1.0, help="Spacing between ridges along Y (default: 1.0)")
     p.add_argument("--elev", type=float, default=8.0, help="View elevation (default: 8)")
@@ -42,19 +42,55 @@ def parse_args():
     return p.parse_args()
 
 def kde_1d(x, grid, bw=None):
-    kde = gaussian_kde(x, bw_method=bw)
-    return kde(grid)
-
-def shade_under_curve(ax, x, y_level, z, color, alpha):
-    """Fill vertical polygon between KDE curve and z=0 plane at fixed y."""
+    """Gaussian KDE on a uniform grid via linear binning + FFT convolution.
+
+    `bw` follows gaussian_kde's scalar convention: kernel sd = bw * std(x).
+    Degenerate or very narrow grids (kernel spanning > 4x the grid) and
+    kernels under two grid steps wide, where linear binning is inaccurate,
+    fall back to direct gaussian_kde evaluation.
+    """
+    x = np.asarray(x, dtype=float)
+    grid = np.asarray(grid, dtype=float)
+    n, G = x.size, len(grid)
+    sigma = (bw if bw is not None else n ** -0.2) * np.std(x, ddof=1)
+    if sigma <= 0:
+        return np.zeros(G)
+    dx = grid[1] - grid[0] if G >= 2 else 0.0
+    if dx <= 0 or 4 * sigma / dx > 4 * G or sigma < 2 * dx:
+        return gaussian_kde(x, bw_method=bw)(grid)
+    K = int(np.ceil(4 * sigma / dx))
+    # Pad the grid as far as the data reaches (1..K points per side; the spare
+    # bin keeps samples on the grid edges inside). Samples farther than 4 sd
+    # from the grid add ~0 and are dropped.
+    pad_lo = int(np.clip(np.ceil((grid[0] - x.min()) / dx), 1, K))
+    pad_hi = int(np.clip(np.ceil((x.max() - grid[-1]) / dx), 1, K))
+    M = G + pad_lo + pad_hi
+    pos = (x - grid[0]) / dx + pad_lo
+    # Snap float round-off at the buffer ends before discarding far samples.
+    snapped = np.clip(pos, 0, M - 1)
+    pos = np.where(np.abs(pos - snapped) <= 1e-6, snapped, pos)
+    pos = pos[(pos >= 0) & (pos <= M - 1)]
+    i = np.minimum(np.floor(pos).astype(int), M - 2)
+    w = pos - i
+    h = (np.bincount(i, 1 - w, minlength=M)
+         + np.bincount(i + 1, w, minlength=M))
+    kernel = np.exp(-0.5 * (np.arange(-K, K + 1) * dx / sigma) ** 2) / (sigma * np.sqrt(2 * np.pi))
+    dens = fftconvolve(h, kernel, mode="same") / n
+    return np.clip(dens[pad_lo:pad_lo + G], 0.0, None)
+
+def ridge_verts(x, y_level, z):
+    """Vertical polygon between KDE curve and z=0 plane at fixed y."""
     verts = [(x[0], y_level, 0.0)]
     verts += [(xi, y_level, zi) for xi, zi in zip(x, z)]
     verts += [(x[-1], y_level, 0.0)]
-    poly = Poly3DCollection([verts], facecolor=color, alpha=alpha, linewidths=0)
-    ax.add_collection3d(poly)
+    return verts
 
 def main():
     a = parse_args()
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    import matplotlib.pyplot as plt
+    from matplotlib.lines import Line2D
+    from mpl_toolkits.mplot3d.art3d import Line3DCollection, Poly3DCollection
     df = pd.read_csv(a.csv)
     if a.xcol not in df or a.gcol not in df:
         raise SystemExit(f"Columns {a.xcol!r} and/or {a.gcol!r} not found in {a.csv}")
@@ -78,7 +114,8 @@ def main():
     ax = fig.add_subplot(111, projection="3d")
     ax.set_box_aspect([3, 1, 2])
 
-    # Plot each group as a ridge along Y
+    # Build every ridge first, then draw them as one fill + one line collection
+    all_verts, curves, ridge_colors = [], [], []
     for i, g in enumerate(groups):
         sub = df[df[a.gcol] == g][a.xcol].values
         if len(sub) < 3:
@@ -88,11 +125,14 @@ def main():
             dens = kde_1d(sub, grid, bw=a.bw)
 
         y_level = i * a.gap
-        color = colors[i % len(colors)]
+        all_verts.append(ridge_verts(grid, y_level, dens))
+        curves.append(np.column_stack([grid, np.full_like(grid, y_level), dens]))
+        ridge_colors.append(colors[i % len(colors)])
 
-        # Filled area + curve
-        shade_under_curve(ax, grid, y_level, dens, color, a.alpha)
-        ax.plot(grid, np.full_like(grid, y_level), dens, color=color, lw=2, alpha=1.0, label=str(g))
+    ax.add_collection3d(Poly3DCollection(all_verts, facecolors=ridge_colors, alpha=a.alpha, linewidths=0))
+    ax.add_collection3d(Line3DCollection(curves, colors=ridge_colors, linewidths=2))
+    zmax = max(float(c[:, 2].max()) for c in curves)
+    ax.auto_scale_xyz(grid, [0.0, (n - 1) * a.gap], [0.0, zmax or 1.0])
 
     # Aesthetics
     ax.view_init(elev=a.elev, azim=a.azim)
@@ -105,7 +145,8 @@ def main():
     ax.zaxis._axinfo["grid"].update(color="gray", linestyle="dashed", linewidth=0.5)
 
     # Legend outside
-    ax.legend(loc="upper left", bbox_to_anchor=(1.02, 1.0), frameon=False, title=a.gcol)
+    handles = [Line2D([], [], color=c, lw=2) for c in ridge_colors]
+    ax.legend(handles, [str(g) for g in groups], loc="upper left", bbox_to_anchor=(1.02, 1.0), frameon=False, title=a.gcol)
 
     plt.tight_layout()
     plt.savefig(a.out, dpi=300, bbox_inches="tight")
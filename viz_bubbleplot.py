@@ -10,7 +10,7 @@ Input CSV must contain at least:
     Frequency     → numeric (bubble area)
 """
 
-import argparse, numpy as np, pandas as pd, matplotlib.pyplot as plt, seaborn as sns
+import argparse, os, numpy as np, pandas as pd
 
 def parse_args():
     p = argparse.ArgumentParser(description="Bubble plot: H5 GLS × NA subtype")
@@ -20,16 +20,23 @@ def parse_args():
     return p.parse_args()
 
 def size_scale(freq):
+    freq = np.asarray(freq, dtype=float)
     fmin, fmax = float(freq.min()), float(freq.max())
     s_min, s_max = 10.0, 2500.0
-    def fn(v):
-        if fmax == fmin:
-            return (s_min + s_max) / 2.0
-        return s_min + (np.sqrt(v - fmin) / np.sqrt(fmax - fmin)) * (s_max - s_min)
-    return np.array([fn(v) for v in freq])
+    if fmax == fmin:
+        return np.full_like(freq, (s_min + s_max) / 2.0)
+    return s_min + (np.sqrt(freq - fmin) / np.sqrt(fmax - fmin)) * (s_max - s_min)
+
+def axis_codes(values, levels):
+    """Position of each value in levels (NaN where absent) via one indexer lookup."""
+    codes = pd.Index(levels).get_indexer(values).astype(float)
+    codes[codes < 0] = np.nan
+    return codes
 
 def main():
     a = parse_args()
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    import matplotlib.pyplot as plt
     df = pd.read_csv(a.csv)
 
     # --- clean inputs ---
@@ -39,14 +46,13 @@ def main():
                      .str.extract(r"(N\d+)", expand=False))
     df = df.dropna(subset=["#GLS", "NA_norm", "Frequency", "Stalk_length"])
 
-    gls_vals = sorted(df["#GLS"].dropna().unique().astype(int))
-    xmap = {v: i for i, v in enumerate(gls_vals)}
-    x = df["#GLS"].map(xmap)
+    gls_vals = sorted(set(df["#GLS"].dropna().astype(int).tolist()))
+    x = axis_codes(df["#GLS"], gls_vals)
 
     na_order = [f"N{i}" for i in range(1, 10)]
-    present = [n for n in na_order if n in df["NA_norm"].unique()]
-    ymap = {n: i for i, n in enumerate(present)}
-    y = df["NA_norm"].map(ymap)
+    uniq = set(df["NA_norm"].dropna().unique().tolist())
+    present = [n for n in na_order if n in uniq]
+    y = axis_codes(df["NA_norm"], present)
 
     sizes = size_scale(df["Frequency"].astype(float).to_numpy())
 